@@ -6,7 +6,33 @@ A package for ESM (Earth System Models) tools with YAML support.
 
 __version__ = "0.1"
 
-# Import modules or define package-level variables/constants here
-from .esm_tools_yaml import EsmToolsYaml, EsmToolsYamlPostprocessor
+# NOTE(PG): The public objects are imported on first access rather than here,
+#           so that ``import esm_tools_yaml`` does not pull in loguru and
+#           ruamel.yaml before they are actually needed.
+_LAZY_ATTRIBUTES = {
+    "EsmToolsYaml": ".esm_tools_yaml",
+    "EsmToolsYamlPostprocessor": ".esm_tools_yaml",
+    "register_tag_constructor": ".constructor",
+    "EsmToolsIncludeCache": ".include",
+}
 
-__all__ = ["EsmToolsYaml", "EsmToolsYamlPostprocessor"]
+__all__ = [
+    "EsmToolsYaml",
+    "EsmToolsYamlPostprocessor",
+    "EsmToolsIncludeCache",
+    "register_tag_constructor",
+]
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -12,6 +12,8 @@ shell expressions, and marking particular blocks for post-processing, such as fe
 
 # NOTE(PG): This module might also cover parsing and transforming dates, I am not sure about that yet.
 
+import copy
+import importlib
 import os
 from functools import wraps
 
@@ -21,6 +23,7 @@ from ruamel.yaml.constructor import RoundTripConstructor
 from .config import EsmToolsConfigSingleton
 from .exceptions import (EsmToolsConstructorEnvironmentVariableError,
                          EsmToolsConstructorFenceTypeError)
+from .include import INCLUDE_TAG, include_constructor
 
 LIST_FENCE_START = "[["
 """str : start of a list fence"""
@@ -32,6 +35,13 @@ DICT_FENCE_START = "{{"
 DICT_FENCE_END = "}}"
 """str : end of a dict fence"""
 
+TAG_ENTRY_POINT_GROUP = "esm_tools_yaml.tags"
+"""str : entry point group used by other packages to provide tag constructors"""
+
+_LAZY_TAG_CONSTRUCTORS = {}
+"""dict : tags whose constructors are only imported once a document uses them"""
+_entry_point_tags_discovered = False
+
 
 class FencedValue:
     # FIXME(PG): I don't really like the names here. Could be more elegant...
@@ -61,6 +71,18 @@ class FencedValue:
         self.fence_placeholder = fence_placeholder
         self.fence_values_to_expand = fence_values_to_expand
 
+    def __deepcopy__(self, memo):
+        # NOTE(PG): Copies are made e.g. for every ``!INCLUDE`` of the same file,
+        #           and need to be expanded during post-processing, too.
+        rvalue = FencedValue(
+            copy.deepcopy(self.value, memo),
+            fence_type=self.fence_type,
+            fence_placeholder=self.fence_placeholder,
+            fence_values_to_expand=self.fence_values_to_expand,
+        )
+        memo[id(self)] = rvalue
+        return _register_fence(rvalue)
+
     def __str__(self):
         return self.value
 
@@ -68,10 +90,22 @@ class FencedValue:
         return self.value
 
 
+def _register_fence(fenced_value):
+    """Records ``fenced_value`` as a post-processing task in the global config"""
+    global_config = EsmToolsConfigSingleton.get_instance().config
+    fences = global_config["postprocess_tasks"]["fences"]
+    fences[id(fenced_value)] = fenced_value
+    return fenced_value
+
+
 def tag_debugger(method):
     """
     You can use this decorator to enable a debug statement when loading specific nodes
     that have been tagged.
+
+    This, like ``tag_replacer``, is meant for constructors registered with
+    ``register_tag_constructor``. The built-in constructors do not use it, so that
+    they are called directly; they log the values they load instead.
     """
 
     @wraps(method)
@@ -82,6 +116,14 @@ def tag_debugger(method):
     return wrapper
 
 
+def _strip_delimiters(node, start_str, end_str):
+    """Removes ``start_str`` and ``end_str`` from the value of ``node``, if present"""
+    if node.value.startswith(start_str):
+        node.value = node.value[len(start_str) :]
+    if node.value.endswith(end_str):
+        node.value = node.value[: -len(end_str)]
+
+
 def tag_replacer(start_str, end_str):
     """
     This decorator will remove ``start_str`` and ``end_str`` from a specific node **before**
@@ -96,12 +138,11 @@ def tag_replacer(start_str, end_str):
     """
 
     def _tag_replacer(method):
+        # NOTE(PG): The built-in constructors call ``_strip_delimiters`` directly,
+        #           since this wrapper costs an extra call for every tagged node.
         @wraps(method)
         def wrapper(loader, node):
-            if node.value.startswith(start_str):
-                node.value = node.value[len(start_str) :]
-            if node.value.endswith(end_str):
-                node.value = node.value[: -len(end_str)]
+            _strip_delimiters(node, start_str, end_str)
             return method(loader, node)
 
         return wrapper
@@ -109,8 +150,6 @@ def tag_replacer(start_str, end_str):
     return _tag_replacer
 
 
-@tag_debugger
-@tag_replacer("${", "}")
 def env_var_constructor(loader, node):
     """
     If a particular node has been tagged with ``!ENV``, the value of that
@@ -153,6 +192,7 @@ def env_var_constructor(loader, node):
         >>> config["MY_VARIABLE"]
         'hello'
     """
+    _strip_delimiters(node, "${", "}")
     env_var_to_return = loader.construct_scalar(node)
     logger.debug(f"{env_var_to_return=}")
     value = os.environ.get(env_var_to_return)
@@ -165,8 +205,6 @@ def env_var_constructor(loader, node):
     return value
 
 
-@tag_debugger
-@tag_replacer("$(", ")")
 def shell_expression_constructor(loader, node):
     """
     If a node has been tagged with ``!SHELL``, the value of the shell
@@ -188,6 +226,7 @@ def shell_expression_constructor(loader, node):
     str :
         The result of the shell expression that has been run.
     """
+    _strip_delimiters(node, "$(", ")")
     value = loader.construct_scalar(node)
     expression_to_run = node.value
     logger.debug(f"{expression_to_run=}")
@@ -199,7 +238,6 @@ def shell_expression_constructor(loader, node):
         raise e
 
 
-@tag_debugger
 def fence_expand_constructor(loader, node):
     value = loader.construct_scalar(node)
     logger.debug(f"{value=}")
@@ -220,17 +258,13 @@ def fence_expand_constructor(loader, node):
     fence_values_to_expand = fence_value.split("-->")[1].strip()
     logger.debug(f"{fence_placeholder=}")
     logger.debug(f"{fence_values_to_expand=}")
-    global_config = EsmToolsConfigSingleton.get_instance().config
-    fences = global_config["postprocess_tasks"]["fences"]
     rvalue = FencedValue(
         value,
         fence_type=fence_type,
         fence_placeholder=fence_placeholder,
         fence_values_to_expand=fence_values_to_expand,
     )
-    breakpoint()
-    fences[id(rvalue)] = rvalue
-    return rvalue
+    return _register_fence(rvalue)
 
 
 class EsmToolsConstructor(RoundTripConstructor):
@@ -246,6 +280,8 @@ class EsmToolsConstructor(RoundTripConstructor):
         * ``!EXPAND`` : This contains the previous "fence" logic to
                         expand lists and dictionaries based upon other
                         values in the configuration.
+        * ``!INCLUDE``: This loads the contents of other YAML files, see
+                        ``esm_tools_yaml.include``.
 
     Note that ``choose`` blocks and variable interpolation is **not**
     done here, rather, that is the job of the postprocessor. Here we
@@ -255,14 +291,26 @@ class EsmToolsConstructor(RoundTripConstructor):
     tasks to be completed later on, which is stored in the config
     ``EsmToolsConfigSingleton``, and later accessed by the ``PostProcessor``
     object.
+
+    Further tags can be added with ``register_tag_constructor``, or by other
+    packages via the ``esm_tools_yaml.tags`` entry point group. These are only
+    imported the first time a document actually uses the tag.
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fences_to_expand = {}
-        self.add_constructor("!ENV", env_var_constructor)
-        self.add_constructor("!SHELL", shell_expression_constructor)
-        self.add_constructor("!EXPAND", fence_expand_constructor)
+
+    def construct_registered_tag(self, node):
+        """
+        Fallback for tags without a known constructor. Lazily registered
+        constructors are imported here, and are afterwards dispatched directly.
+        Anything else is handled like any other unknown tag.
+        """
+        constructor = _resolve_tag_constructor(str(node.tag))
+        if constructor is None:
+            return self.construct_unknown(node)
+        return constructor(self, node)
 
     # NOTE(PG): The next few methods are placeholders in case we
     #           need to override the basic constructors.
@@ -274,3 +322,95 @@ class EsmToolsConstructor(RoundTripConstructor):
 
     def construct_scalar(self, node):
         return super().construct_scalar(node)
+
+
+EsmToolsConstructor.add_constructor("!ENV", env_var_constructor)
+EsmToolsConstructor.add_constructor("!SHELL", shell_expression_constructor)
+EsmToolsConstructor.add_constructor("!EXPAND", fence_expand_constructor)
+EsmToolsConstructor.add_constructor(INCLUDE_TAG, include_constructor)
+EsmToolsConstructor.add_constructor(None, EsmToolsConstructor.construct_registered_tag)
+
+
+def register_tag_constructor(tag, constructor):
+    """
+    Registers a constructor for a custom tag.
+
+    Parameters
+    ----------
+    tag : str
+        The tag to handle, including the leading ``!``, e.g. ``!DATE``.
+    constructor : callable or str
+        Either the constructor itself, called with ``(loader, node)``, or
+        a ``"module:attribute"`` string pointing to it. In the latter case,
+        the module is only imported once a document uses ``tag``.
+
+    Example
+    -------
+    The ``tag_debugger`` and ``tag_replacer`` decorators can be used for
+    plugin constructors, at the cost of an extra call per tagged node::
+
+        @tag_debugger
+        @tag_replacer("<", ">")
+        def date_constructor(loader, node):
+            return parse_date(loader.construct_scalar(node))
+
+        register_tag_constructor("!DATE", date_constructor)
+    """
+    if isinstance(constructor, str):
+        # NOTE(PG): The lazy lookup only happens for tags without a constructor,
+        #           so any previous one has to go for the new one to be used.
+        EsmToolsConstructor.yaml_constructors.pop(tag, None)
+        _LAZY_TAG_CONSTRUCTORS[tag] = constructor
+    else:
+        _LAZY_TAG_CONSTRUCTORS.pop(tag, None)
+        EsmToolsConstructor.add_constructor(tag, constructor)
+
+
+def _discover_entry_point_tags():
+    """
+    Collects (but does not load) tag constructors advertised by installed packages.
+
+    An entry point named ``DATE`` in the ``esm_tools_yaml.tags`` group handles the
+    ``!DATE`` tag. Explicitly registered constructors take precedence.
+    """
+    global _entry_point_tags_discovered
+    _entry_point_tags_discovered = True
+    from importlib.metadata import entry_points
+
+    try:
+        tag_entry_points = entry_points(group=TAG_ENTRY_POINT_GROUP)
+    except TypeError:  # Python < 3.10
+        tag_entry_points = entry_points().get(TAG_ENTRY_POINT_GROUP, [])
+    for entry_point in tag_entry_points:
+        tag = f"!{entry_point.name.lstrip('!')}"
+        if tag not in EsmToolsConstructor.yaml_constructors:
+            _LAZY_TAG_CONSTRUCTORS.setdefault(tag, entry_point)
+
+
+def _resolve_tag_constructor(tag):
+    """
+    Imports the constructor registered for ``tag`` and installs it on
+    ``EsmToolsConstructor``, so that later nodes skip this lookup entirely.
+
+    Returns
+    -------
+    callable or None :
+        The constructor, or ``None`` if nothing is registered for ``tag``.
+    """
+    if not _entry_point_tags_discovered:
+        _discover_entry_point_tags()
+    target = _LAZY_TAG_CONSTRUCTORS.get(tag)
+    if target is None:
+        return None
+    if isinstance(target, str):
+        module_name, _, attribute = target.partition(":")
+        constructor = getattr(importlib.import_module(module_name), attribute)
+    else:
+        constructor = target.load()
+    constructor_name = getattr(constructor, "__name__", repr(constructor))
+    logger.debug(f"Loaded tag constructor {constructor_name} for {tag}")
+    EsmToolsConstructor.add_constructor(tag, constructor)
+    # Only forget the lazy target once it is installed, so that a failed
+    # import is raised again for the next document rather than ignored:
+    _LAZY_TAG_CONSTRUCTORS.pop(tag, None)
+    return constructor
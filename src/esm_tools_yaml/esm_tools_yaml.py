@@ -1,10 +1,10 @@
 # from .config import EsmToolsSimulationConfig
-import dpath.util
 from loguru import logger
 from ruamel.yaml import YAML
 
 from .config import EsmToolsConfigSingleton
 from .constructor import EsmToolsConstructor, FencedValue
+from .include import get_session_include_cache
 
 # from .constructor import EsmToolsConstructor
 
@@ -18,6 +18,11 @@ class EsmToolsYaml(YAML):
     add_provenance : bool
         Whether or not to add provenance comments to the YAML file when using this
         object to dump the finished config back to disk. Default is ``False``.
+    include_cache : EsmToolsIncludeCache, optional
+        Cache of files loaded via ``!INCLUDE``. Default is the session cache shared
+        by all ``EsmToolsYaml`` objects, so that files included by several
+        components are only parsed once. Pass a new ``EsmToolsIncludeCache`` to
+        opt out.
     *args
         Any other arguments typically passed to the YAML class.
         See https://tinyurl.com/mu98x55s
@@ -35,6 +40,9 @@ class EsmToolsYaml(YAML):
         for kwarg_key, kwarg_value in kwargs.items():
             logger.debug(f"{kwarg_key=}, {kwarg_value=}")
         self.add_provenance = kwargs.pop("add_provenance", False)
+        self.include_cache = kwargs.pop("include_cache", None)
+        if self.include_cache is None:
+            self.include_cache = get_session_include_cache()
         super().__init__(*args, **kwargs)
         self.Constructor = EsmToolsConstructor
         # self.Resolver = ...
@@ -47,6 +55,13 @@ class EsmToolsYaml(YAML):
         # self.Composer: ...
 
 
+def _iter_slots(container):
+    """Lazily yields ``(container, key, value)`` for each entry of a dict or list"""
+    if isinstance(container, dict):
+        return ((container, key, value) for key, value in container.items())
+    return ((container, index, item) for index, item in enumerate(container))
+
+
 # NOTE(PG): This could be folded into the EsmToolsYaml class, but I'm keeping it
 # separate for now to make it easier to understand the different parts of the code.
 #
@@ -72,7 +87,6 @@ class EsmToolsYamlPostprocessor:
         data = self.recursive_run_method(data, self.substitute_variables)
         data = self.recursive_run_method(data, self.do_math)
         data = self.recursive_run_method(data, self.run_chooses)
-        breakpoint()
         data = self.recursive_run_method(data, self.replace_fence)
         return data
 
@@ -80,6 +94,12 @@ class EsmToolsYamlPostprocessor:
         """
         Recursively run a method on the YAML data.
 
+        The nested dicts and lists are walked with an explicit stack of
+        iterators rather than by recursion, so arbitrarily deep configs do
+        not hit the recursion limit, and memory only grows with the nesting
+        depth, not with the width of the config. Containers are modified in
+        place, and only for values that ``method`` actually replaced.
+
         Parameters
         ----------
         data : dict
@@ -96,16 +116,20 @@ class EsmToolsYamlPostprocessor:
             "fences"
         ]
         logger.debug(f"{all_fences=}")
-        breakpoint()
         logger.debug(f"Running {method.__name__} on {type(data)=}")
-        if isinstance(data, dict):
-            for key, value in data.items():
-                data[key] = self.recursive_run_method(value, method, *args, **kwargs)
-        elif isinstance(data, list):
-            for index, item in enumerate(data):
-                data[index] = self.recursive_run_method(item, method, *args, **kwargs)
-        else:
-            data = method(data, *args, **kwargs)
+        if not isinstance(data, (dict, list)):
+            return method(data, *args, **kwargs)
+        stack = [_iter_slots(data)]
+        while stack:
+            for container, key, value in stack[-1]:
+                if isinstance(value, (dict, list)):
+                    stack.append(_iter_slots(value))
+                    break
+                new_value = method(value, *args, **kwargs)
+                if new_value is not value:
+                    container[key] = new_value
+            else:
+                stack.pop()
         return data
 
     def substitute_variables(self, data):
@@ -171,7 +195,6 @@ class EsmToolsYamlPostprocessor:
             The processed YAML data.
         """
         if isinstance(data, FencedValue):
-            breakpoint()
             logger.debug(f"{data=}")
             logger.debug(f"{data.fence_placeholder=}")
             logger.debug(f"{data.fence_values_to_expand=}")
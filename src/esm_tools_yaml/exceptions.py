@@ -20,3 +20,7 @@ class EsmToolsConstructorFenceTypeError(EsmToolsConstructorError):
 
 class EsmToolsConstructorEnvironmentVariableError(EsmToolsConstructorError):
     """Raise this when an environment variable is not set"""
+
+
+class EsmToolsConstructorIncludeCycleError(EsmToolsConstructorError):
+    """Raise this when a file includes itself, directly or indirectly"""
@@ -0,0 +1,282 @@
+"""
+This provides the ``!INCLUDE`` tag, which loads other YAML files into the
+configuration, as well as the cache backing it.
+
+Every file is read and parsed only once per ``EsmToolsIncludeCache``, no matter how
+often it is included, e.g. for machine or defaults files shared by all components.
+Unless given a cache of their own, all ``EsmToolsYaml`` objects share the session
+cache returned by ``get_session_include_cache``.
+Reading happens in a thread pool: as soon as a file has been read, the files it
+includes are requested as well, so the whole include tree is read concurrently
+while the main thread is still parsing. Parsing itself happens in the thread that
+loads the including document. Several threads may load through the same cache at
+once; a file needed by one while another parses it is waited for, not re-parsed.
+"""
+
+import copy
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock, get_ident, local
+
+from loguru import logger
+from ruamel.yaml.nodes import SequenceNode
+
+from .exceptions import EsmToolsConstructorIncludeCycleError
+
+INCLUDE_TAG = "!INCLUDE"
+"""str : tag used to include another file"""
+
+_INCLUDE_PATTERN = re.compile(r"^[^#\n]*?!INCLUDE\s+(\[[^\]]*\]|[^\s#]+)", re.MULTILINE)
+"""re.Pattern : best guess at included paths, used to start reading them early"""
+
+_session_include_cache = None
+
+
+def _resolve_path(path, directory):
+    path = os.path.expanduser(os.path.expandvars(path))
+    return os.path.realpath(os.path.join(directory, path))
+
+
+class EsmToolsIncludeCache:
+    """
+    Holds every file parsed through ``!INCLUDE`` during one session.
+
+    By default, all ``EsmToolsYaml`` objects share the session cache from
+    ``get_session_include_cache``. Pass a separate cache with the
+    ``include_cache`` argument to opt out, e.g. when files change on disk
+    during the session.
+
+    The cache reads files in a thread pool, which can be shut down with
+    ``close`` or by using the cache as a context manager. The pool is
+    started again if the cache is used afterwards.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Number of threads used to read files. Defaults to the
+        ``ThreadPoolExecutor`` default.
+
+    Properties
+    ----------
+    documents : dict
+        The parsed documents, keyed by their absolute path.
+    """
+
+    def __init__(self, max_workers=None):
+        self.documents = {}
+        self.max_workers = max_workers
+        self._reads = {}
+        self._reads_lock = Lock()
+        self._executor = None
+        # Guards ``documents`` and the bookkeeping of which thread parses what:
+        self._parsing_condition = Condition()
+        self._parsing = {}
+        self._waiting = {}
+        self._local = local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shuts down the threads used for reading files"""
+        with self._reads_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def prefetch(self, *paths):
+        """Starts reading ``paths`` in the background, unless already done"""
+        for path in paths:
+            self._submit(path)
+
+    def current_directory(self):
+        """The directory of the file currently being included in this thread, if any"""
+        chain = self._chain()
+        if chain:
+            return os.path.dirname(chain[-1])
+        return None
+
+    def load(self, path, yaml_class):
+        """
+        Returns the contents of ``path``, parsing it on first use.
+
+        Parameters
+        ----------
+        path : str
+            Absolute path of the file to include.
+        yaml_class : type
+            The ``EsmToolsYaml`` class used to parse the file.
+
+        Returns
+        -------
+        Any :
+            A copy of the parsed document, so that changes made to one include
+            do not leak into all other places the same file is included.
+
+        Raises
+        ------
+        EsmToolsConstructorIncludeCycleError :
+            Raised when ``path`` is already being included further up.
+        """
+        chain = self._chain()
+        if path in chain:
+            cycle = " -> ".join(chain[chain.index(path) :] + (path,))
+            raise EsmToolsConstructorIncludeCycleError(f"Include cycle: {cycle}")
+        if not self._claim(path, chain):
+            return copy.deepcopy(self.documents[path])
+        try:
+            text = self._read_text(path)
+            logger.debug(f"Parsing included file {path}")
+            self._local.chain = chain + (path,)
+            try:
+                document = yaml_class(include_cache=self).load(text)
+            finally:
+                self._local.chain = chain
+        except BaseException:
+            with self._parsing_condition:
+                del self._parsing[path]
+                self._parsing_condition.notify_all()
+            raise
+        with self._parsing_condition:
+            self.documents[path] = document
+            del self._parsing[path]
+            self._parsing_condition.notify_all()
+        with self._reads_lock:
+            self._reads.pop(path, None)
+        return copy.deepcopy(document)
+
+    def _chain(self):
+        """The files being included in this thread, outermost first"""
+        return getattr(self._local, "chain", ())
+
+    def _claim(self, path, chain):
+        """
+        Returns ``True`` if the calling thread should parse ``path``, or
+        ``False`` once another thread has put it into ``documents``.
+        """
+        me = get_ident()
+        with self._parsing_condition:
+            while path not in self.documents:
+                if path not in self._parsing:
+                    self._parsing[path] = me
+                    return True
+                # Threads waiting on each other in a loop can only get there
+                # through files that include each other:
+                owner = self._parsing[path]
+                seen = set()
+                while owner != me and owner not in seen:
+                    seen.add(owner)
+                    owner = self._parsing.get(self._waiting.get(owner))
+                if owner == me:
+                    cycle = " -> ".join(chain + (path,))
+                    raise EsmToolsConstructorIncludeCycleError(
+                        f"Include cycle: {cycle} -> ... (continued in another thread)"
+                    )
+                self._waiting[me] = path
+                try:
+                    self._parsing_condition.wait()
+                finally:
+                    del self._waiting[me]
+            return False
+
+    def _read_text(self, path):
+        future = self._submit(path)
+        try:
+            return future.result()
+        except BaseException:
+            # Forget the failed read, so that the next include tries again:
+            with self._reads_lock:
+                if self._reads.get(path) is future:
+                    del self._reads[path]
+            raise
+
+    def _submit(self, path, prefetch=False):
+        with self._reads_lock:
+            if path in self.documents:
+                return None
+            if path not in self._reads:
+                if self._executor is None:
+                    if prefetch:
+                        # Closed while reading, the file is read once it is needed
+                        return None
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="esm_tools_yaml_include",
+                    )
+                self._reads[path] = self._executor.submit(self._read, path)
+            return self._reads[path]
+
+    def _read(self, path):
+        with open(path, "r") as included_file:
+            text = included_file.read()
+        directory = os.path.dirname(path)
+        for match in _INCLUDE_PATTERN.finditer(text):
+            for included_path in match.group(1).strip("[]").split(","):
+                included_path = included_path.strip().strip("'\"")
+                if included_path:
+                    self._submit(_resolve_path(included_path, directory), prefetch=True)
+        return text
+
+
+def get_session_include_cache():
+    """Returns the include cache shared by all ``EsmToolsYaml`` objects by default"""
+    global _session_include_cache
+    if _session_include_cache is None:
+        _session_include_cache = EsmToolsIncludeCache()
+    return _session_include_cache
+
+
+def include_constructor(loader, node):
+    """
+    If a node has been tagged with ``!INCLUDE``, the contents of the
+    referenced file are returned. A list of files can also be given, in
+    which case a list with the contents of each file is returned.
+
+    Relative paths are resolved against the directory of the including
+    file, or the current working directory if that is not known.
+
+    Parameters
+    ----------
+    loader : ~FIXME_LOADER
+        The instantiated ``Constructor`` object used to load
+        this node
+
+    node : Any
+        The path (or list of paths) to include.
+
+    Returns
+    -------
+    Any :
+        The parsed contents of the included file(s).
+
+    Example
+    -------
+    ..code ::
+
+        $ cat config.yaml
+            computer: !INCLUDE machines/levante.yaml
+            further_reading: !INCLUDE [defaults/general.yaml, defaults/fesom.yaml]
+    """
+    yaml_instance = loader.loader
+    cache = yaml_instance.include_cache
+    directory = cache.current_directory()
+    if directory is None:
+        stream_name = node.start_mark.name
+        directory = (
+            os.path.dirname(os.path.abspath(stream_name))
+            if os.path.isfile(stream_name)
+            else os.getcwd()
+        )
+    if isinstance(node, SequenceNode):
+        paths = [
+            _resolve_path(loader.construct_scalar(path_node), directory)
+            for path_node in node.value
+        ]
+        cache.prefetch(*paths)
+        return [cache.load(path, type(yaml_instance)) for path in paths]
+    path = _resolve_path(loader.construct_scalar(node), directory)
+    return cache.load(path, type(yaml_instance))
@@ -0,0 +1,38 @@
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-slow", action="store_true", default=False, help="run slow benchmarks"
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: benchmark, only run with --run-slow")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-slow"):
+        return
+    skip_slow = pytest.mark.skip(reason="needs --run-slow to run")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Reports the time and peak memory recorded by the tracemalloc tests"""
+    reports = [
+        report
+        for report in terminalreporter.stats.get("passed", [])
+        if report.when == "call" and dict(report.user_properties).get("peak_bytes")
+    ]
+    if not reports:
+        return
+    terminalreporter.section("time and peak memory")
+    for report in reports:
+        properties = dict(report.user_properties)
+        terminalreporter.write_line(
+            f"{report.nodeid}: {properties['seconds']:.2f} s, "
+            f"peak {properties['peak_bytes']} bytes"
+        )
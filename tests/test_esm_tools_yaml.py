@@ -2,10 +2,19 @@
 # -*- coding: utf-8 -*-
 
 import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import tracemalloc
 
 import pytest
 
 import esm_tools_yaml
+from esm_tools_yaml import constructor, include
+from esm_tools_yaml.config import EsmToolsConfigSingleton
+from esm_tools_yaml.exceptions import EsmToolsConstructorIncludeCycleError
 
 TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
 TEST_FILE = f"{TESTING_DIR}/test.yaml"
@@ -71,3 +80,390 @@ def test_env_variable(user_config):
 
 def test_fence_expand(postprocessed_fence_config):
     assert "my_a_in_streams" in postprocessed_fence_config["all_vars"]
+
+
+def test_import_is_lazy():
+    check_modules = (
+        "import sys, esm_tools_yaml; "
+        "print(any(mod in sys.modules for mod in ('loguru', 'ruamel.yaml', 'dpath')))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", check_modules], capture_output=True, text=True
+    )
+    assert result.stdout.strip() == "False"
+
+
+@pytest.fixture
+def tag_plugin(tmp_path, monkeypatch):
+    """An importable ``my_tag_plugin`` module; the tag registry is reset afterwards"""
+    (tmp_path / "my_tag_plugin.py").write_text(
+        textwrap.dedent(
+            """
+            def upper_constructor(loader, node):
+                return loader.construct_scalar(node).upper()
+
+            def lower_constructor(loader, node):
+                return loader.construct_scalar(node).lower()
+            """
+        )
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(
+        constructor.EsmToolsConstructor,
+        "yaml_constructors",
+        dict(constructor.EsmToolsConstructor.yaml_constructors),
+    )
+    monkeypatch.setattr(constructor, "_LAZY_TAG_CONSTRUCTORS", {})
+    monkeypatch.setattr(constructor, "_entry_point_tags_discovered", True)
+    yield "my_tag_plugin"
+    sys.modules.pop("my_tag_plugin", None)
+
+
+class FakeEntryPoint:
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+        module_name, _, attribute = self.value.partition(":")
+        return getattr(__import__(module_name), attribute)
+
+
+def test_lazy_tag_constructor(tag_plugin, esm_tools_yaml_constructor):
+    esm_tools_yaml.register_tag_constructor("!UPPER", f"{tag_plugin}:upper_constructor")
+    assert tag_plugin not in sys.modules
+    config = esm_tools_yaml_constructor.load("a: !UPPER hello\nb: !UPPER world\n")
+    assert config["a"] == "HELLO"
+    assert config["b"] == "WORLD"
+    assert tag_plugin in sys.modules
+
+
+def test_lazy_tag_constructor_reregistered(tag_plugin, esm_tools_yaml_constructor):
+    esm_tools_yaml.register_tag_constructor("!CASE", lambda loader, node: "eager")
+    esm_tools_yaml.register_tag_constructor("!CASE", f"{tag_plugin}:upper_constructor")
+    assert esm_tools_yaml_constructor.load("a: !CASE Hi\n")["a"] == "HI"
+    esm_tools_yaml.register_tag_constructor("!CASE", f"{tag_plugin}:lower_constructor")
+    assert esm_tools_yaml_constructor.load("a: !CASE Hi\n")["a"] == "hi"
+
+
+def test_lazy_tag_constructor_import_error(tag_plugin, esm_tools_yaml_constructor):
+    esm_tools_yaml.register_tag_constructor("!BROKEN", "nonexistent_mod:constructor")
+    for _ in range(2):
+        with pytest.raises(ModuleNotFoundError):
+            esm_tools_yaml_constructor.load("a: !BROKEN hi\n")
+
+
+@pytest.mark.parametrize("entry_points_api", ["group_keyword", "python_3_9"])
+def test_entry_point_tag_constructor(
+    tag_plugin, monkeypatch, esm_tools_yaml_constructor, entry_points_api
+):
+    import importlib.metadata
+
+    entry_point = FakeEntryPoint("UPPER", f"{tag_plugin}:upper_constructor")
+
+    def entry_points(**kwargs):
+        if entry_points_api == "group_keyword":
+            assert kwargs["group"] == constructor.TAG_ENTRY_POINT_GROUP
+            return [entry_point]
+        if kwargs:
+            raise TypeError("entry_points() got an unexpected keyword argument 'group'")
+        return {constructor.TAG_ENTRY_POINT_GROUP: [entry_point]}
+
+    monkeypatch.setattr(importlib.metadata, "entry_points", entry_points)
+    monkeypatch.setattr(constructor, "_entry_point_tags_discovered", False)
+    esm_tools_yaml_constructor.load("a: !OTHER unrelated\n")
+    assert constructor._entry_point_tags_discovered
+    assert not entry_point.loaded
+    assert esm_tools_yaml_constructor.load("a: !UPPER hello\n")["a"] == "HELLO"
+    assert entry_point.loaded
+
+
+@pytest.fixture
+def include_cache():
+    with esm_tools_yaml.EsmToolsIncludeCache() as cache:
+        yield cache
+
+
+def test_include_parses_shared_file_once(tmp_path, monkeypatch, include_cache):
+    (tmp_path / "machine.yaml").write_text("name: levante\ncores: 128\n")
+    (tmp_path / "fesom.yaml").write_text("computer: !INCLUDE machine.yaml\n")
+    (tmp_path / "echam.yaml").write_text("computer: !INCLUDE ./machine.yaml\n")
+    (tmp_path / "setup.yaml").write_text(
+        "models: !INCLUDE [fesom.yaml, echam.yaml]\nmachine: !INCLUDE machine.yaml\n"
+    )
+    monkeypatch.chdir(tmp_path)
+    yaml_instance = esm_tools_yaml.EsmToolsYaml(include_cache=include_cache)
+    loaded = []
+    original_load = esm_tools_yaml.EsmToolsYaml.load
+
+    def counting_load(self, stream):
+        loaded.append(stream)
+        return original_load(self, stream)
+
+    monkeypatch.setattr(esm_tools_yaml.EsmToolsYaml, "load", counting_load)
+    config = yaml_instance.load("setup: !INCLUDE setup.yaml\n")
+    # One load for the string above, plus one per distinct file:
+    assert len(loaded) == 5
+    assert len(include_cache.documents) == 4
+    fesom, echam = config["setup"]["models"]
+    assert fesom["computer"] == echam["computer"] == config["setup"]["machine"]
+    assert fesom["computer"]["cores"] == 128
+    assert fesom["computer"] is not echam["computer"]
+
+
+def test_include_session_cache_is_shared(tmp_path, monkeypatch):
+    (tmp_path / "machine.yaml").write_text("name: levante\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(include, "_session_include_cache", None)
+    fesom_yaml = esm_tools_yaml.EsmToolsYaml()
+    echam_yaml = esm_tools_yaml.EsmToolsYaml()
+    with fesom_yaml.include_cache as session_cache:
+        assert echam_yaml.include_cache is session_cache
+        fesom_yaml.load("computer: !INCLUDE machine.yaml\n")
+        parsed = session_cache.documents[str(tmp_path / "machine.yaml")]
+        echam_yaml.load("computer: !INCLUDE machine.yaml\n")
+        assert session_cache.documents[str(tmp_path / "machine.yaml")] is parsed
+
+
+def test_include_reads_nested_files_ahead(tmp_path, monkeypatch, include_cache):
+    (tmp_path / "setup.yaml").write_text("model: !INCLUDE models/fesom.yaml\n")
+    (tmp_path / "models").mkdir()
+    (tmp_path / "models" / "fesom.yaml").write_text(
+        "computer: !INCLUDE [../machine.yaml, ../defaults.yaml]\n"
+    )
+    (tmp_path / "machine.yaml").write_text("name: levante\n")
+    (tmp_path / "defaults.yaml").write_text("cores: 128\n")
+    monkeypatch.chdir(tmp_path)
+    submitted_by = {}
+    original_submit = include.EsmToolsIncludeCache._submit
+
+    def recording_submit(self, path, prefetch=False):
+        submitted_by.setdefault(os.path.basename(path), threading.current_thread())
+        return original_submit(self, path, prefetch)
+
+    monkeypatch.setattr(include.EsmToolsIncludeCache, "_submit", recording_submit)
+    yaml_instance = esm_tools_yaml.EsmToolsYaml(include_cache=include_cache)
+    config = yaml_instance.load("setup: !INCLUDE setup.yaml\n")
+    assert config["setup"]["model"]["computer"][1]["cores"] == 128
+    # Only the first file is requested by the parser, the reader threads request
+    # the others as soon as they see them:
+    assert submitted_by.pop("setup.yaml") is threading.main_thread()
+    assert set(submitted_by) == {"fesom.yaml", "machine.yaml", "defaults.yaml"}
+    for thread in submitted_by.values():
+        assert thread.name.startswith("esm_tools_yaml_include")
+
+
+def test_include_close_stops_threads(tmp_path, monkeypatch, include_cache):
+    (tmp_path / "machine.yaml").write_text("name: levante\n")
+    monkeypatch.chdir(tmp_path)
+    yaml_instance = esm_tools_yaml.EsmToolsYaml(include_cache=include_cache)
+    yaml_instance.load("computer: !INCLUDE machine.yaml\n")
+    include_cache.close()
+    assert not any(
+        thread.name.startswith("esm_tools_yaml_include")
+        for thread in threading.enumerate()
+    )
+
+
+def test_include_fenced_file_twice(tmp_path, monkeypatch, include_cache):
+    (tmp_path / "fenced.yaml").write_text(
+        "f: !EXPAND my_[[ STREAM --> stream]]_in_streams\n"
+    )
+    monkeypatch.chdir(tmp_path)
+    yaml_instance = esm_tools_yaml.EsmToolsYaml(include_cache=include_cache)
+    config = yaml_instance.load("a: !INCLUDE fenced.yaml\nb: !INCLUDE fenced.yaml\n")
+    fences = EsmToolsConfigSingleton.get_instance().config["postprocess_tasks"][
+        "fences"
+    ]
+    assert config["a"]["f"] is not config["b"]["f"]
+    for fenced_value in (config["a"]["f"], config["b"]["f"]):
+        assert fences[id(fenced_value)] is fenced_value
+        assert fenced_value.fence_placeholder == "STREAM"
+
+
+def write_component_tree(tmp_path, component, parts):
+    component_dir = tmp_path / component
+    component_dir.mkdir()
+    (component_dir / "settings.yaml").write_text(f"component: {component}\n")
+    for part in range(parts):
+        (component_dir / f"part{part}.yaml").write_text(
+            f"part: {part}\n"
+            "settings: !INCLUDE settings.yaml\n"
+            "computer: !INCLUDE ../machine.yaml\n"
+        )
+    part_list = ", ".join(f"part{part}.yaml" for part in range(parts))
+    (component_dir / "setup.yaml").write_text(f"parts: !INCLUDE [{part_list}]\n")
+
+
+def test_include_from_several_threads(tmp_path, monkeypatch, include_cache):
+    (tmp_path / "machine.yaml").write_text("name: levante\n")
+    components = ["fesom", "echam"]
+    for component in components:
+        write_component_tree(tmp_path, component, parts=100)
+    parsed = []
+    original_load = esm_tools_yaml.EsmToolsYaml.load
+
+    def recording_load(self, stream):
+        parsed.append(stream)
+        return original_load(self, stream)
+
+    monkeypatch.setattr(esm_tools_yaml.EsmToolsYaml, "load", recording_load)
+    barrier = threading.Barrier(len(components))
+    results = {}
+
+    def load_component(component):
+        yaml_instance = esm_tools_yaml.EsmToolsYaml(include_cache=include_cache)
+        barrier.wait()
+        try:
+            results[component] = yaml_instance.load(
+                f"setup: !INCLUDE {tmp_path / component / 'setup.yaml'}\n"
+            )
+        except Exception as error:
+            results[component] = error
+
+    threads = [
+        threading.Thread(target=load_component, args=(component,))
+        for component in components
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    for component in components:
+        parts = results[component]["setup"]["parts"]
+        assert [part["part"] for part in parts] == list(range(100))
+        assert {part["settings"]["component"] for part in parts} == {component}
+        assert {part["computer"]["name"] for part in parts} == {"levante"}
+    # Two top-level strings, plus every distinct file exactly once:
+    assert len(include_cache.documents) == 1 + 2 * 102
+    assert len(parsed) == 2 + len(include_cache.documents)
+
+
+def test_include_cycle_across_threads(tmp_path, include_cache):
+    (tmp_path / "a.yaml").write_text("b: !INCLUDE b.yaml\n")
+    (tmp_path / "b.yaml").write_text("a: !INCLUDE a.yaml\n")
+    barrier = threading.Barrier(2)
+    errors = []
+
+    def load_file(name):
+        yaml_instance = esm_tools_yaml.EsmToolsYaml(include_cache=include_cache)
+        barrier.wait()
+        try:
+            yaml_instance.load(f"start: !INCLUDE {tmp_path / name}.yaml\n")
+        except EsmToolsConstructorIncludeCycleError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=load_file, args=(name,)) for name in "ab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(errors) == 2
+
+
+def test_include_retries_failed_read(tmp_path, monkeypatch, include_cache):
+    monkeypatch.chdir(tmp_path)
+    yaml_instance = esm_tools_yaml.EsmToolsYaml(include_cache=include_cache)
+    with pytest.raises(FileNotFoundError):
+        yaml_instance.load("later: !INCLUDE later.yaml\n")
+    (tmp_path / "later.yaml").write_text("created: true\n")
+    assert yaml_instance.load("later: !INCLUDE later.yaml\n")["later"]["created"]
+
+
+def test_include_prefetch_skips_comments(tmp_path, monkeypatch, include_cache):
+    (tmp_path / "machine.yaml").write_text(
+        "# old: !INCLUDE /nonexistent/zzz.yaml\n"
+        "name: levante  # was !INCLUDE /nonexistent/yyy.yaml\n"
+        "defaults: !INCLUDE defaults.yaml\n"
+    )
+    (tmp_path / "defaults.yaml").write_text("cores: 128\n")
+    monkeypatch.chdir(tmp_path)
+    yaml_instance = esm_tools_yaml.EsmToolsYaml(include_cache=include_cache)
+    config = yaml_instance.load("computer: !INCLUDE machine.yaml\n")
+    assert config["computer"]["defaults"]["cores"] == 128
+    # Nothing was read for the comments, and the texts of parsed files are dropped:
+    assert include_cache._reads == {}
+
+
+def test_include_cycle(tmp_path, monkeypatch, include_cache):
+    (tmp_path / "a.yaml").write_text("b: !INCLUDE b.yaml\n")
+    (tmp_path / "b.yaml").write_text("a: !INCLUDE a.yaml\n")
+    monkeypatch.chdir(tmp_path)
+    yaml_instance = esm_tools_yaml.EsmToolsYaml(include_cache=include_cache)
+    with pytest.raises(
+        EsmToolsConstructorIncludeCycleError, match=r"a\.yaml -> .*b\.yaml -> .*a\.yaml"
+    ):
+        yaml_instance.load("a: !INCLUDE a.yaml\n")
+
+
+class SetItemCountingDict(dict):
+    setitem_calls = 0
+
+    def __setitem__(self, key, value):
+        SetItemCountingDict.setitem_calls += 1
+        super().__setitem__(key, value)
+
+
+def run_traced(record_property, method, *args):
+    """Runs ``method``, and records the time taken and the peak memory allocated"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = method(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    record_property("seconds", time.perf_counter() - start)
+    record_property("peak_bytes", peak)
+    return result, peak
+
+
+def test_recursive_run_method_only_writes_changes():
+    postprocessor = esm_tools_yaml.EsmToolsYamlPostprocessor()
+    config = SetItemCountingDict(a=1, b=[2, SetItemCountingDict(c="x")], d="keep")
+    SetItemCountingDict.setitem_calls = 0
+    postprocessor.recursive_run_method(config, lambda value: value)
+    assert SetItemCountingDict.setitem_calls == 0
+    postprocessor.recursive_run_method(
+        config, lambda value: value.upper() if value == "x" else value
+    )
+    assert SetItemCountingDict.setitem_calls == 1
+    assert config == {"a": 1, "b": [2, {"c": "X"}], "d": "keep"}
+
+
+@pytest.mark.slow
+def test_recursive_run_method_wide_config(record_property):
+    postprocessor = esm_tools_yaml.EsmToolsYamlPostprocessor()
+    config = {
+        f"component_{component}": {f"key_{key}": key for key in range(1000)}
+        for component in range(1000)
+    }
+    _, peak = run_traced(
+        record_property,
+        postprocessor.recursive_run_method,
+        config,
+        postprocessor.substitute_variables,
+    )
+    # A million leaves, but nothing proportional to them is allocated:
+    assert peak < 64 * 1024
+
+
+def test_recursive_run_method_deep_config(record_property):
+    postprocessor = esm_tools_yaml.EsmToolsYamlPostprocessor()
+    depth = 20 * sys.getrecursionlimit()
+    config = leaf = {}
+    for _ in range(depth):
+        leaf["level"] = {}
+        leaf = leaf["level"]
+    leaf["value"] = 1
+    _, peak = run_traced(
+        record_property,
+        postprocessor.recursive_run_method,
+        config,
+        lambda value: value + 1,
+    )
+    assert leaf["value"] == 2
+    assert peak < depth * 2048